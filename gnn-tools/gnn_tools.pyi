@@ -1,5 +1,5 @@
 from typing import List, Tuple
 
 def shortest_paths(
-    edges: List[Tuple[int, int]], max_path_len: int
-) -> Tuple[List[List[List[int]]], List[List[List[int]]]]: ...
+    sources: List[int], targets: List[int], num_nodes: int, max_path_len: int
+) -> Tuple[List[int], List[int]]: ...
@@ -1,94 +1,159 @@
-use petgraph::graph::{NodeIndex, UnGraph};
-use petgraph::visit::{Bfs, IntoNodeIdentifiers};
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
-use std::collections::hash_set::HashSet;
+use std::collections::VecDeque;
 
-#[derive(Debug, Clone)]
-struct Paths<const N: usize> {
-    node_paths: Vec<[i16; N]>,
-    edge_paths: Vec<[i16; N]>,
+/// An undirected graph in compressed sparse row form.
+///
+/// The neighbors of each node are listed in the order `petgraph::UnGraph` iterates them: edges leaving the node
+/// newest first, then edges entering it newest first, with self loops only listed once. Keeping that order keeps
+/// the choice between equally short paths unchanged.
+struct Csr {
+    indptr: Vec<usize>,
+    indices: Vec<usize>,
+    edge_ids: Vec<usize>,
 }
 
-fn shortest_paths_from_source<const N: usize>(
-    g: &UnGraph<u32, ()>,
-    source: NodeIndex,
-    paths: &mut Paths<N>,
+impl Csr {
+    fn from_edges(sources: &[u32], targets: &[u32], num_nodes: usize) -> Self {
+        let edges: Vec<(u32, u32)> = sources.iter().copied().zip(targets.iter().copied()).collect();
+        let mut indptr = vec![0; num_nodes + 1];
+        for &(a, b) in &edges {
+            indptr[a as usize + 1] += 1;
+            if a != b {
+                indptr[b as usize + 1] += 1;
+            }
+        }
+        for i in 0..num_nodes {
+            indptr[i + 1] += indptr[i];
+        }
+
+        let num_entries = indptr[num_nodes];
+        let mut indices = vec![0; num_entries];
+        let mut edge_ids = vec![0; num_entries];
+        let mut cursor = indptr[..num_nodes].to_vec();
+        for (edge_id, &(a, b)) in edges.iter().enumerate().rev() {
+            let a = a as usize;
+            indices[cursor[a]] = b as usize;
+            edge_ids[cursor[a]] = edge_id;
+            cursor[a] += 1;
+        }
+        for (edge_id, &(a, b)) in edges.iter().enumerate().rev() {
+            if a == b {
+                continue;
+            }
+            let b = b as usize;
+            indices[cursor[b]] = a as usize;
+            edge_ids[cursor[b]] = edge_id;
+            cursor[b] += 1;
+        }
+
+        Csr {
+            indptr,
+            indices,
+            edge_ids,
+        }
+    }
+
+    fn num_nodes(&self) -> usize {
+        self.indptr.len() - 1
+    }
+
+    /// The (neighbor, edge id) pairs of `node`
+    fn neighbors(&self, node: usize) -> impl Iterator<Item = (usize, usize)> + '_ {
+        let range = self.indptr[node]..self.indptr[node + 1];
+        self.indices[range.clone()]
+            .iter()
+            .copied()
+            .zip(self.edge_ids[range].iter().copied())
+    }
+}
+
+/// Breadth first search from `source`, writing the path to every reachable node.
+///
+/// `node_paths` and `edge_paths` hold one row of `max_path_len` entries per node and must be filled with -1.
+/// Each node's path is its BFS parent's path plus one node and one edge, so the search only tracks depths. Paths
+/// longer than `max_path_len` keep their first `max_path_len` entries.
+fn shortest_paths_from_source(
+    g: &Csr,
+    source: usize,
+    max_path_len: usize,
+    node_paths: &mut [i16],
+    edge_paths: &mut [i16],
 ) {
-    let num_nodes = g.node_count();
-    if num_nodes == 0 {
+    let num_nodes = g.num_nodes();
+    if num_nodes == 0 || max_path_len == 0 {
         return;
     }
-    paths.node_paths[source.index()][0] = source.index() as i16;
-    let mut bfs = Bfs::new(g, source);
-    let mut visited = HashSet::new();
-    visited.insert(source);
-
-    while let Some(v) = bfs.next(&g) {
-        for w in g.neighbors(v) {
-            if visited.contains(&w) {
+    // Doubles as the visited set
+    let mut depth = vec![usize::MAX; num_nodes];
+    let mut queue = VecDeque::with_capacity(num_nodes);
+
+    depth[source] = 0;
+    node_paths[source * max_path_len] = source as i16;
+    queue.push_back(source);
+
+    while let Some(v) = queue.pop_front() {
+        let v_row = v * max_path_len..(v + 1) * max_path_len;
+        for (w, edge_id) in g.neighbors(v) {
+            if depth[w] != usize::MAX {
                 continue;
             }
-            visited.insert(w);
-            let w_idx = w.index();
-            let v_idx = v.index();
-            paths.node_paths[w_idx] = paths.node_paths[v_idx];
-            paths.edge_paths[w_idx] = paths.edge_paths[v_idx];
-            if let Some(w_node_col_idx) = paths.node_paths[w_idx].iter().position(|&x| x == -1) {
-                paths.node_paths[w_idx][w_node_col_idx] = w_idx as i16;
-                if let Some(w_edge_col_idx) = paths.edge_paths[w_idx].iter().position(|&x| x == -1)
-                {
-                    let edge_nodes = &paths.node_paths[w_idx][w_node_col_idx - 1..=w_node_col_idx];
-                    if let Some(ei) =
-                        g.find_edge((edge_nodes[0] as u32).into(), (edge_nodes[1] as u32).into())
-                    {
-                        paths.edge_paths[w.index()][w_edge_col_idx] = ei.index() as i16;
-                    }
-                }
+            let w_depth = depth[v] + 1;
+            depth[w] = w_depth;
+            queue.push_back(w);
+
+            let w_row = w * max_path_len;
+            node_paths.copy_within(v_row.clone(), w_row);
+            edge_paths.copy_within(v_row.clone(), w_row);
+            // Past the cutoff the parent's path is already full, so the copy is the whole truncated path
+            if w_depth < max_path_len {
+                node_paths[w_row + w_depth] = w as i16;
+            }
+            if w_depth <= max_path_len {
+                edge_paths[w_row + w_depth - 1] = edge_id as i16;
             }
         }
     }
 }
 
+/// All pairs shortest paths of the graph given by the `sources` and `targets` rows of an edge index.
+///
+/// Returns the node and edge paths flattened from shape (num_nodes, num_nodes, max_path_len), padded with -1.
 #[pyfunction]
 fn shortest_paths(
-    edges: Vec<(u32, u32)>,
+    sources: Vec<u32>,
+    targets: Vec<u32>,
+    num_nodes: usize,
     max_path_len: usize,
-) -> (Vec<Vec<Vec<i16>>>, Vec<Vec<Vec<i16>>>) {
-    let g = UnGraph::<u32, ()>::from_edges(edges);
-
-    let num_nodes = g.node_count();
-
-    let mut paths = vec![
-        Paths {
-            node_paths: vec![[-1; 64]; num_nodes],
-            edge_paths: vec![[-1; 64]; num_nodes],
-        };
-        num_nodes
-    ];
-
-    let mut node_paths = Vec::with_capacity(num_nodes);
-    let mut edge_paths = Vec::with_capacity(num_nodes);
-
-    for source in g.node_identifiers() {
-        shortest_paths_from_source(&g, source, &mut paths[source.index()]);
+) -> PyResult<(Vec<i16>, Vec<i16>)> {
+    if sources.len() != targets.len() {
+        return Err(PyValueError::new_err(
+            "sources and targets must have the same length",
+        ));
+    }
+    if sources
+        .iter()
+        .chain(targets.iter())
+        .any(|&node| node as usize >= num_nodes)
+    {
+        return Err(PyValueError::new_err("edge endpoints must be less than num_nodes"));
     }
+    let g = Csr::from_edges(&sources, &targets, num_nodes);
+
+    let mut node_paths = vec![-1; num_nodes * num_nodes * max_path_len];
+    let mut edge_paths = vec![-1; num_nodes * num_nodes * max_path_len];
 
-    for path in paths {
-        node_paths.push(
-            path.node_paths
-                .into_iter()
-                .map(|x| x[..max_path_len].to_vec())
-                .collect(),
-        );
-        edge_paths.push(
-            path.edge_paths
-                .into_iter()
-                .map(|x| x[..max_path_len].to_vec())
-                .collect(),
-        );
+    // Every source owns a contiguous (num_nodes, max_path_len) block of the output, so search straight into it
+    let block_len = (num_nodes * max_path_len).max(1);
+    for (source, (source_node_paths, source_edge_paths)) in node_paths
+        .chunks_mut(block_len)
+        .zip(edge_paths.chunks_mut(block_len))
+        .enumerate()
+    {
+        shortest_paths_from_source(&g, source, max_path_len, source_node_paths, source_edge_paths);
     }
 
-    (node_paths, edge_paths)
+    Ok((node_paths, edge_paths))
 }
 
 #[pymodule]
@@ -144,13 +209,13 @@ mod test {
             (18, 3),
             (18, 17),
         ];
-        let graph = UnGraph::<u32, ()>::from_edges(edges);
-        let num_nodes = graph.node_count();
-        let mut paths = Paths {
-            node_paths: vec![[-1; 6]; num_nodes],
-            edge_paths: vec![[-1; 6]; num_nodes],
-        };
-        shortest_paths_from_source(&graph, 0.into(), &mut paths);
+        let (sources, targets): (Vec<u32>, Vec<u32>) = edges.into_iter().unzip();
+        let num_nodes = 19;
+        let graph = Csr::from_edges(&sources, &targets, num_nodes);
+        let max_path_len = 5;
+        let mut node_paths = vec![-1; num_nodes * max_path_len];
+        let mut edge_paths = vec![-1; num_nodes * max_path_len];
+        shortest_paths_from_source(&graph, 0, max_path_len, &mut node_paths, &mut edge_paths);
 
         let expected_node_paths = [
             [0, -1, -1, -1, -1],
@@ -174,9 +239,8 @@ mod test {
             [0, 1, 3, 18, -1],
         ];
 
-        let shortened_node_paths: Vec<[i16; 5]> = paths
-            .node_paths
-            .into_iter()
+        let shortened_node_paths: Vec<[i16; 5]> = node_paths
+            .chunks(max_path_len)
             .map(|x| {
                 let mut items = [0; 5];
                 items.copy_from_slice(&x[..5]);
@@ -217,9 +281,8 @@ mod test {
             [0, 3, 7, -1, -1],
         ];
 
-        let shortened_edge_paths: Vec<[i16; 5]> = paths
-            .edge_paths
-            .into_iter()
+        let shortened_edge_paths: Vec<[i16; 5]> = edge_paths
+            .chunks(max_path_len)
             .map(|x| {
                 let mut items = [0; 5];
                 items.copy_from_slice(&x[..5]);
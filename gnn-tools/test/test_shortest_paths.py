@@ -45,7 +45,12 @@ class TestShortestPathsGroup:
             (18, 3),
             (18, 17),
         ]
-        node_paths, edge_paths = gnn_tools.shortest_paths(edges, 5)
+        sources, targets = zip(*edges)
+        num_nodes = 19
+        node_paths, edge_paths = gnn_tools.shortest_paths(list(sources), list(targets), num_nodes, 5)
+        # Paths are flattened from (num_nodes, num_nodes, max_path_len), take the rows for source 0
+        source_node_paths = [node_paths[i * 5 : (i + 1) * 5] for i in range(num_nodes)]
+        source_edge_paths = [edge_paths[i * 5 : (i + 1) * 5] for i in range(num_nodes)]
         expected_node_paths = [
             [0, -1, -1, -1, -1],
             [0, 1, -1, -1, -1],
@@ -67,7 +72,7 @@ class TestShortestPathsGroup:
             [0, 1, 3, 18, 17],
             [0, 1, 3, 18, -1],
         ]
-        assert node_paths[0] == expected_node_paths
+        assert source_node_paths == expected_node_paths
 
         expected_edge_paths = [
             [-1, -1, -1, -1, -1],
@@ -91,4 +96,4 @@ class TestShortestPathsGroup:
             [0, 3, 7, -1, -1],
         ]
 
-        assert edge_paths[0] == expected_edge_paths
+        assert source_edge_paths == expected_edge_paths
@@ -10,7 +10,6 @@ import optuna
 from graphormer.config.hparams import HyperparameterConfig, hyperparameters
 from graphormer.config.options import (
     OptimizerType,
-    DatasetType,
     DatasetRegime,
 )
 from graphormer.config.tuning_hparams import TuningHyperparameterConfig, tuning_hyperparameters
@@ -35,7 +34,10 @@ def train(**kwargs):
 def tune(**kwargs):
     hparam_config = TuningHyperparameterConfig(**kwargs)
     data_config = hparam_config.data_config()
+    # Build the dataset once and share the loaders between every trial
     train_loader, test_loader = data_config.build()
+    hparam_config.node_feature_dim = data_config.num_node_features
+    hparam_config.edge_feature_dim = data_config.num_edge_features
     study = optuna.create_study(
         direction="minimize",
         study_name=hparam_config.study_name,
@@ -110,7 +112,7 @@ def tune(**kwargs):
                     "clip_grad_norm": 5.0,
                 },
             )
-        case OptimizerType.ADAMW:
+        case OptimizerType.ADAMW | OptimizerType.LAMB | OptimizerType.AUTO:
             # Baseline
             starting_points.append(
                 {
@@ -182,14 +184,6 @@ def inference(mc_samples: Optional[int], **kwargs):
     save_results(results, hparam_config.name, mc_dropout)
 
 
-@click.command()
-@hyperparameters
-def estimate_noise_scale(**kwargs):
-    hparam_config = HyperparameterConfig(**kwargs)
-    hparam_config.load_from_checkpoint()
-    torch.manual_seed(hparam_config.random_state)
-
-
 # Example: poetry run analyze --models results,results2,results3
 @click.command()
 @click.option("--bac_csv_path", type=click.Path(exists=True), default="results/MC_BACs.csv")
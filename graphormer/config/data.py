@@ -50,8 +50,9 @@ class DataConfig:
         dataloader_optimization_params = {
             "pin_memory": True,
             "num_workers": self.num_workers,
-            "prefetch_factor": self.prefetch_factor,
-            "persistent_workers": True,
+            # Both are only accepted by DataLoader when loading happens in worker processes
+            "prefetch_factor": self.prefetch_factor if self.num_workers > 0 else None,
+            "persistent_workers": self.num_workers > 0,
         }
         match self.dataset_type:
             case DatasetType.HANSEN:
@@ -90,6 +90,8 @@ hyperparameters = create_composite_decorator(
     click.option("--name", default=None),
     click.option("--checkpt_save_interval", default=5),
     click.option("--accumulation_steps", default=1),
+    click.option("--torch_compile", default=False),
+    click.option("--amp", default=False),
     click.option("--loss_reduction", type=click.Choice(LossReductionType, case_sensitive=False), default=LossReductionType.MEAN),  # type: ignore
     click.option("--checkpoint_dir", default="pretrained_models"),
     click.option("--dropout", default=0.05),
@@ -182,6 +184,8 @@ class HyperparameterConfig:
         accumulation_steps: Optional[int] = None,
         checkpt_save_interval: int = 1,
         checkpoint_dir: str = "pretrained_models",
+        torch_compile: bool = False,
+        amp: bool = False,
         # Logging Parameters
         logdir: Optional[str] = None,
         flush_secs: Optional[int] = None,
@@ -267,6 +271,8 @@ class HyperparameterConfig:
         self.epochs = epochs
         self.checkpt_save_interval = checkpt_save_interval
         self.checkpoint_dir = checkpoint_dir
+        self.torch_compile = torch_compile
+        self.amp = amp
         # Logging Parameters
         self.logdir = logdir
         self.flush_secs = flush_secs
@@ -1,8 +1,12 @@
 from typing import Dict, Self, Tuple
 from graphormer.config.options import OptimizerType, LossReductionType
+from graphormer.optimizers import Lamb
 from torch.optim import SGD, AdamW, Optimizer
 import torch.nn as nn
 
+# Effective batch size above which OptimizerType.AUTO switches from AdamW to LAMB
+LAMB_BATCH_SIZE_THRESHOLD = 8192
+
 
 class OptimizerConfig:
     def __init__(
@@ -62,7 +66,20 @@ class OptimizerConfig:
         return self
 
     def build(self, model: nn.Module) -> Optimizer:
-        match self.optimizer_type:
+        # Update every parameter in one fused kernel on CUDA, or at least in multi-tensor (foreach) ops elsewhere.
+        # Resumed optimizers keep whichever implementation their checkpoint was saved with.
+        if all(param.is_cuda for param in model.parameters()):
+            kernel_params = {"fused": True}
+        else:
+            kernel_params = {"foreach": True}
+
+        optimizer_type = self.optimizer_type
+        if optimizer_type == OptimizerType.AUTO:
+            optimizer_type = (
+                OptimizerType.LAMB if self.effective_batch_size > LAMB_BATCH_SIZE_THRESHOLD else OptimizerType.ADAMW
+            )
+
+        match optimizer_type:
             case OptimizerType.ADAMW:
                 if self.betas is None:
                     raise AttributeError("betas are not defined for AdamW optimizer")
@@ -76,6 +93,7 @@ class OptimizerConfig:
                     "betas": self.betas,
                     "eps": self.eps,
                     "weight_decay": self.weight_decay,
+                    **kernel_params,
                 }
                 optimizer = AdamW(model.parameters(), **adam_params)
                 if self.state_dict is not None:
@@ -97,9 +115,29 @@ class OptimizerConfig:
                     "nesterov": self.nesterov,
                     "dampening": self.dampening,
                     "weight_decay": self.weight_decay,
+                    **kernel_params,
                 }
                 optimizer = SGD(model.parameters(), **sgd_params)
                 if self.state_dict is not None:
                     optimizer.load_state_dict(self.state_dict)
                     self.state_dict = None
                 return optimizer
+            case OptimizerType.LAMB:
+                if self.betas is None:
+                    raise AttributeError("betas are not defined for LAMB optimizer")
+                if self.eps is None:
+                    raise AttributeError("eps is not defined for LAMB optimizer")
+                if self.weight_decay is None:
+                    raise AttributeError("weight_decay is not defined for LAMB optimizer")
+
+                lamb_params = {
+                    "lr": self.effective_lr,
+                    "betas": self.betas,
+                    "eps": self.eps,
+                    "weight_decay": self.weight_decay,
+                }
+                optimizer = Lamb(model.parameters(), **lamb_params)
+                if self.state_dict is not None:
+                    optimizer.load_state_dict(self.state_dict)
+                    self.state_dict = None
+                return optimizer
@@ -12,6 +12,8 @@ class SchedulerType(str, Enum):
 class OptimizerType(str, Enum):
     ADAMW = "adam"
     SGD = "sgd"
+    LAMB = "lamb"
+    AUTO = "auto"
 
 
 class DatasetType(str, Enum):
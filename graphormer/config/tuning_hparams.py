@@ -405,7 +405,7 @@ class TuningHyperparameterConfig:
                 dampening = 0.0
                 if not nesterov:
                     dampening = trial.suggest_float("dampening", self.min_dampening, self.max_dampening)
-            case OptimizerType.ADAMW:
+            case OptimizerType.ADAMW | OptimizerType.LAMB | OptimizerType.AUTO:
                 b1 = trial.suggest_float("b1", self.min_b1, self.max_b1)
                 b2 = trial.suggest_float("b2", self.min_b2, self.max_b2)
                 eps = trial.suggest_float("eps", self.min_eps, self.max_eps)
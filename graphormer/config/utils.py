@@ -1,22 +1,24 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 import torch
 from torch.nn.modules.loss import _Loss
+from torch.utils.data import Dataset, Subset
+from torch_geometric.data import InMemoryDataset
 from torch_geometric.loader import DataLoader
 from graphormer.config.hparams import HyperparameterConfig
 from tqdm import tqdm
 
 
-def save_checkpoint(
+def snapshot_checkpoint(
     epoch: int,
     hparams: HyperparameterConfig,
     model: torch.nn.Module,
     optimizer: torch.optim.Optimizer,
     loss: _Loss,
     lr_scheduler: Optional[torch.optim.lr_scheduler.LRScheduler] = None,
-    suffix: Optional[str] = None,
-) -> None:
+) -> Dict[str, Any]:
     """
-    Save the model weights, optimizer state, and other necessary information to a checkpoint file.
+    Collect a checkpoint whose tensors are CPU copies, so it can be written by `write_checkpoint` on another
+    thread while training carries on updating the live state.
 
     Args:
         epoch (int): The current epoch index.
@@ -26,6 +28,41 @@ def save_checkpoint(
         loss (torch.nn.modules.loss._Loss): The loss function used for training the model
         lr_scheduler (torch.optim.lr_scheduler.LRScheduler, optional): The learning rate scheduler used during training. Defaults to None.
 
+    Returns:
+        Dict[str, Any]: The checkpoint, ready to be passed to `write_checkpoint`
+    """
+    return _to_cpu(
+        {
+            "epoch": epoch,
+            "hyperparameters": vars(hparams),
+            "model_state_dict": model.state_dict(),
+            "optimizer_state_dict": optimizer.state_dict(),
+            "scheduler_state_dict": None if lr_scheduler is None else lr_scheduler.state_dict(),
+            "loss_state_dict": loss.state_dict(),
+        }
+    )
+
+
+def _to_cpu(value: Any) -> Any:
+    # Copies containers as well as tensors, as state dicts share nested lists and dicts with the live objects
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: _to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_cpu(item) for item in value)
+    return value
+
+
+def write_checkpoint(checkpoint: Dict[str, Any], hparams: HyperparameterConfig, suffix: Optional[str] = None) -> None:
+    """
+    Write a checkpoint collected by `snapshot_checkpoint` to the checkpoint directory.
+
+    Args:
+        checkpoint (Dict[str, Any]): The checkpoint to write.
+        hparams (HyperparameterConfig): The hyperparameters for the training session, used for the checkpoint path
+        suffix (str, optional): Appended to the checkpoint name. Defaults to None.
+
     Returns:
         None
     """
@@ -35,24 +72,16 @@ def save_checkpoint(
     if not os.path.exists(hparams.checkpoint_dir):
         os.makedirs(hparams.checkpoint_dir)
 
-    checkpoint = {
-        "epoch": epoch,
-        "hyperparameters": vars(hparams),
-        "model_state_dict": model.state_dict(),
-        "optimizer_state_dict": optimizer.state_dict(),
-        "scheduler_state_dict": None if lr_scheduler is None else lr_scheduler.state_dict(),
-        "loss_state_dict": loss.state_dict(),
-    }
-
     name = hparams.name
     if suffix is not None:
         name = f"{hparams.name}_{suffix}"
 
+    # Runs on a background thread while the progress bar is live, so write around the bar rather than through it
     try:
         torch.save(checkpoint, f"{hparams.checkpoint_dir}/{name}.pt")
-        print(f"Checkpoint successfully saved to {hparams.checkpoint_dir}/{name}.pt")
+        tqdm.write(f"Checkpoint successfully saved to {hparams.checkpoint_dir}/{name}.pt")
     except Exception as e:
-        print(f"Failed to save {hparams.checkpoint_dir}/{name}. Error: {e}")
+        tqdm.write(f"Failed to save {hparams.checkpoint_dir}/{name}. Error: {e}")
 
 
 def model_init_print(
@@ -106,10 +135,29 @@ def model_init_print(
 
 
 def calculate_pos_weight(loader: DataLoader):
-    num_neg_samples = 0
-    num_pos_samples = 0
-    print("Calculating positive weight...")
-    for sample in tqdm(loader):
-        num_pos_samples += torch.sum(sample.y).item()
-        num_neg_samples += torch.sum(sample.y == 0).item()
+    """
+    Calculate the ratio of negative to positive samples in a loader's dataset.
+
+    The labels are read straight from the dataset rather than by iterating the loader, which would collate and pad
+    every batch just to count them.
+
+    Args:
+        loader (DataLoader): The loader whose dataset to weight, optionally a `Subset` of an `InMemoryDataset`.
+
+    Returns:
+        torch.Tensor: A single element tensor holding the positive weight.
+    """
+    y = _dataset_labels(loader.dataset)  # type: ignore
+    num_pos_samples = torch.sum(y).item()
+    num_neg_samples = torch.sum(y == 0).item()
     return torch.tensor([num_neg_samples / num_pos_samples])
+
+
+def _dataset_labels(dataset: Dataset) -> torch.Tensor:
+    # Index the collated label storage directly. `dataset.y` on an index-selected `InMemoryDataset` would first
+    # collate every selected graph, paths and all, just to return their labels.
+    if isinstance(dataset, Subset):
+        return _dataset_labels(dataset.dataset)[torch.as_tensor(dataset.indices)]
+    if isinstance(dataset, InMemoryDataset):
+        return dataset._data.y[torch.as_tensor(dataset.indices())]  # type: ignore
+    return torch.cat([data.y for data in dataset])  # type: ignore
@@ -1,45 +1,107 @@
-from typing import Optional
+import os
+import pickle
+from typing import Optional, Tuple
 
 import torch
+from joblib import Memory
 from rdkit import Chem
-from torch_geometric.utils import degree
+from torch_geometric.data import Data
+from torch_geometric.utils import degree, from_smiles
 
 from graphormer.functional import shortest_path_distance
 
 
-def check_smiles_and_label(smiles, label) -> Optional[str]:
-    if torch.isnan(label):
-        return f"WARN: No label for {smiles}, skipped"
-
-    mol = Chem.MolFromSmiles(smiles)
-    if mol is None:
-        return f"WARN: Invalid SMILES {smiles}, skipped"
-
-    return None
+def process(data, max_distance: int):
 
+    node_paths, edge_paths, extra_edge_idxs = shortest_path_distance(data.edge_index, data.x.shape[0], max_distance)
 
-def process(data, max_distance: int):
+    num_atoms, num_node_features = data.x.shape
+    num_nodes = num_atoms + 1
+    num_edges = data.edge_index.shape[1]
+    num_edge_features = data.edge_attr.shape[1]
 
-    node_paths, edge_paths, extra_edge_idxs = shortest_path_distance(data.edge_index, max_distance)
+    # Allocate each tensor once at its final size and fill it in place, VNODE first
+    x = torch.empty(num_nodes, num_node_features)
+    x[0] = -1
+    x[1:] = data.x
+    data.x = x
 
-    data.x = torch.cat((torch.ones(1, data.x.shape[1]) * -1, data.x), dim=0)
-    new_idxs = torch.stack((torch.zeros(data.x.shape[0]), torch.arange(0, data.x.shape[0])), dim=0).transpose(0, 1)
+    edge_index = torch.zeros(2, num_nodes + num_edges, dtype=torch.long)
+    edge_index[1, :num_nodes] = torch.arange(num_nodes)
+    edge_index[:, num_nodes:] = data.edge_index
+    data.edge_index = edge_index
 
-    data.edge_index = torch.cat((new_idxs, data.edge_index.transpose(0, 1)), dim=0).transpose(0, 1).long()
     data.degrees = torch.stack(
         [degree(data.edge_index[:, 1], data.x.shape[0]), degree(data.edge_index[:, 0], data.x.shape[0])],
     ).transpose(0, 1)
     data.node_paths = node_paths
     data.edge_paths = edge_paths
-    data.edge_attr = torch.cat(
-        (
-            torch.ones(1, data.edge_attr.shape[1]) * -1,
-            data.edge_attr,
-            torch.ones(extra_edge_idxs.shape[0], data.edge_attr.shape[1]) * -1,
-        ),
-        dim=0,
-    )
+
+    edge_attr = torch.full((1 + num_edges + extra_edge_idxs.shape[0], num_edge_features), -1.0)
+    edge_attr[1 : num_edges + 1] = data.edge_attr
+    data.edge_attr = edge_attr
 
     assert data.degrees.shape[0] == data.x.shape[0]
 
     return data
+
+
+def mol_to_graph(smiles: str, max_distance: int) -> Data:
+    """
+    Build the processed, unlabelled graph for a molecule.
+
+    Args:
+        smiles (str): The canonical SMILES of the molecule, also used as the cache key
+        max_distance (int): The maximum shortest path length to compute
+
+    Returns:
+        Data: The processed graph, without a label
+    """
+    data = from_smiles(smiles)
+    return process(data, max_distance)
+
+
+# Bump whenever `process` or `shortest_path_distance` change the graphs they produce, to invalidate cached graphs
+GRAPH_CACHE_VERSION = 3
+
+cached_mol_to_graph = mol_to_graph
+
+
+def init_graph_cache(cache_dir: Optional[str]) -> None:
+    """
+    Cache `mol_to_graph` on disk for the current process.
+
+    Used as a `multiprocessing.Pool` initializer so that every worker shares the same store.
+
+    Args:
+        cache_dir (str, optional): The directory to cache graphs in. Caching is disabled if None.
+    """
+    global cached_mol_to_graph
+    if cache_dir is not None:
+        cache_dir = os.path.join(cache_dir, f"v{GRAPH_CACHE_VERSION}")
+    cached_mol_to_graph = Memory(cache_dir, verbose=0).cache(mol_to_graph)
+
+
+def process_smiles(row: Tuple[str, int]) -> bytes | str:
+    """
+    Convert a single (smiles, max_distance) row into a processed graph.
+
+    This lives at module level so that it can be dispatched to a `multiprocessing.Pool`. The processed graph is
+    returned pickled, as tensors sent back through a pool are otherwise moved into one shared memory segment each.
+
+    Graphs are looked up by canonical SMILES, so molecules shared between datasets are only processed once. Labels
+    are attached by the caller, so neither the cache nor the workers ever see them.
+
+    Returns:
+        bytes | str: The pickled `Data` object, or a warning if the row was skipped
+    """
+    smiles, max_distance = row
+
+    # The graph is built from the canonical SMILES, so that cache hits and misses give the same graph
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return f"WARN: Invalid SMILES {smiles}, skipped"
+
+    data = cached_mol_to_graph(Chem.MolToSmiles(mol), max_distance)
+    data.smiles = smiles
+    return pickle.dumps(data)
@@ -1,8 +1,8 @@
-from typing import Any, List, Union, Sequence, Optional, override
+from typing import Any, Iterable, Iterator, List, Union, Sequence, Optional, override
 import torch
-import torch.nn.utils.rnn as rnn
 from torch_geometric.data import Data
 from torch_geometric.loader.dataloader import BaseData, Collater, DataLoader, Dataset, DatasetAdapter
+from torch_geometric.utils import to_dense_batch
 
 
 class GraphormerDataLoader(DataLoader):
@@ -49,68 +49,88 @@ class GraphormerCollater(Collater):
         assert data.node_paths is not None
         assert data.edge_paths is not None
         assert data.degrees is not None
-        x = data.x.float()
-        edge_index = data.edge_index
-        edge_attr = data.edge_attr.float()
-        node_paths = data.node_paths
-        edge_paths = data.edge_paths
-        degrees = data.degrees
         ptr = data.ptr
-
-        node_subgraphs = []
-        edge_attr_subgraphs = []
-        node_paths_subgraphs = []
-        edge_paths_subgraphs = []
-        degree_subgraphs = []
-        subgraph_idxs = torch.stack([ptr[:-1], ptr[1:]], dim=1)
-        subgraph_sq_ptr = torch.cat(
-            [torch.tensor([0]).to(x.device), (subgraph_idxs[:, 1] - subgraph_idxs[:, 0]).square().cumsum(dim=0)]
-        )
-        subgraph_idxs_sq = torch.stack([subgraph_sq_ptr[:-1], subgraph_sq_ptr[1:]], dim=1)
-        max_nodes = 0
-        path_length = node_paths.shape[-1]
-        for idx_range, idx_range_sq in zip(subgraph_idxs.tolist(), subgraph_idxs_sq.tolist()):
-            subgraph = x[idx_range[0] : idx_range[1]]
-            num_nodes = idx_range[1] - idx_range[0]
-            if num_nodes > max_nodes:
-                max_nodes = num_nodes
-
-            node_subgraphs.append(subgraph)
-            degree_subgraphs.append(degrees[idx_range[0] : idx_range[1], :])
-
-            start_edge_index = (edge_index[0] < idx_range[0]).sum()
-            stop_edge_index = (edge_index[0] < idx_range[1]).sum()
-
-            edge_attr_subgraphs.append(edge_attr[start_edge_index:stop_edge_index, :])
-            node_paths_subgraphs.append(
-                node_paths[idx_range_sq[0] : idx_range_sq[1]].reshape(num_nodes, num_nodes, path_length)
-            )
-            edge_paths_subgraphs.append(
-                edge_paths[idx_range_sq[0] : idx_range_sq[1]].reshape(num_nodes, num_nodes, path_length)
-            )
-        target_shape = (max_nodes, max_nodes, path_length)
-
-        node_subgraphs_padded = []
-        edge_subgraphs_padded = []
-        for node_subgraph, edge_subgraph in zip(node_paths_subgraphs, edge_paths_subgraphs):
-            pad_bottom = target_shape[0] - node_subgraph.shape[0]
-            pad_right = target_shape[1] - node_subgraph.shape[1]
-
-            # (left, right, top, bottom, front, back)
-            pad = (0, pad_right, 0, pad_bottom)
-            node_subgraphs_padded.append(
-                torch.nn.functional.pad(node_subgraph.permute(2, 0, 1), pad, mode="constant", value=-1).permute(1, 2, 0)
-            )
-            edge_subgraphs_padded.append(
-                torch.nn.functional.pad(edge_subgraph.permute(2, 0, 1), pad, mode="constant", value=-1).permute(1, 2, 0)
-            )
-
-        node_paths = torch.stack(node_subgraphs_padded).long()
-        edge_paths = torch.stack(edge_subgraphs_padded).long()
-
-        data.x = rnn.pad_sequence(node_subgraphs, batch_first=True, padding_value=-2)
-        data.degrees = rnn.pad_sequence(degree_subgraphs, batch_first=True, padding_value=-1).transpose(1, 2).long()
-        data.edge_attr = rnn.pad_sequence(edge_attr_subgraphs, batch_first=True, padding_value=-1)
+        node_batch = data.batch
+        batch_size = ptr.shape[0] - 1
+        num_nodes = ptr[1:] - ptr[:-1]
+        max_nodes = int(num_nodes.max())
+        path_length = data.node_paths.shape[-1]
+
+        # Pad every graph out to the largest graph in the batch with one scatter per tensor, rather than slicing and
+        # padding each graph in turn
+        dense_params = {"max_num_nodes": max_nodes, "batch_size": batch_size}
+        x = to_dense_batch(data.x.float(), node_batch, fill_value=-2, **dense_params)[0]
+        degrees = to_dense_batch(data.degrees, node_batch, fill_value=-1, **dense_params)[0]
+
+        # Edges belong to the graph of their source node
+        edge_batch = node_batch[data.edge_index[0]]
+        edge_attr = to_dense_batch(data.edge_attr.float(), edge_batch, fill_value=-1, batch_size=batch_size)[0]
+
+        # Paths are stored flattened as (num_nodes ** 2, path_length) per graph, recover the (graph, row, col) of
+        # every entry and scatter them into padded (max_nodes, max_nodes, path_length) blocks
+        num_pairs = num_nodes.square()
+        pair_batch = torch.repeat_interleave(torch.arange(batch_size, device=ptr.device), num_pairs)
+        pair_ptr = num_pairs.cumsum(dim=0) - num_pairs
+        local_pair = torch.arange(pair_batch.shape[0], device=ptr.device) - pair_ptr[pair_batch]
+        pair_num_nodes = num_nodes[pair_batch]
+        pair_row = local_pair // pair_num_nodes
+        pair_col = local_pair % pair_num_nodes
+
+        # Always int16, also for datasets processed before graphs stored their paths as int16
+        target_shape = (batch_size, max_nodes, max_nodes, path_length)
+        node_paths = torch.full(target_shape, -1, dtype=torch.int16, device=ptr.device)
+        node_paths[pair_batch, pair_row, pair_col] = data.node_paths
+        edge_paths = torch.full(target_shape, -1, dtype=torch.int16, device=ptr.device)
+        edge_paths[pair_batch, pair_row, pair_col] = data.edge_paths
+
+        data.x = x
+        data.degrees = degrees.transpose(1, 2).long()
+        data.edge_attr = edge_attr
+        # Paths stay int16 so that they are a quarter of the size to pin and copy to the device, the edge encoding
+        # widens them once they are there
         data.node_paths = node_paths
         data.edge_paths = edge_paths
         return data
+
+
+class DevicePrefetcher:
+    """
+    Iterate a loader with every batch already moved to `device`.
+
+    On CUDA the next batch is copied on a side stream while the current one is in use, so host to device copies
+    overlap with compute. On other devices batches are moved as they are yielded.
+    """
+
+    def __init__(self, loader: Iterable[GraphormerBatch], device: torch.device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device) if device.type == "cuda" else None
+
+    def __iter__(self) -> Iterator[GraphormerBatch]:
+        if self.stream is None:
+            for batch in self.loader:
+                yield batch.to(self.device, non_blocking=True)
+            return
+
+        batches = iter(self.loader)
+        next_batch = self._prefetch(batches)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(self.stream)
+            batch = next_batch
+            # The copies were allocated on the side stream, stop the allocator reusing them while still in use here
+            batch.apply(lambda tensor: _record_stream(tensor, current_stream))
+            next_batch = self._prefetch(batches)
+            yield batch
+
+    def _prefetch(self, batches: Iterator[GraphormerBatch]) -> Optional[GraphormerBatch]:
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        with torch.cuda.stream(self.stream):  # type: ignore
+            return batch.to(self.device, non_blocking=True)
+
+
+def _record_stream(tensor: torch.Tensor, stream: torch.cuda.Stream) -> torch.Tensor:
+    tensor.record_stream(stream)
+    return tensor
@@ -1,6 +1,6 @@
 import torch
 from ogb.graphproppred import PygGraphPropPredDataset
-from graphormer.data.datasets.graphormer_dataset import process
+from graphormer.data.data_cleaning import process
 from tqdm import tqdm
 import numpy as np
 import os.path as osp
@@ -11,8 +11,9 @@ import pandas as pd
 class OGBDataset(PygGraphPropPredDataset):
     def __init__(self, root, transform=None, pre_transform=None, max_distance: int = 5):
         self.max_distance = max_distance
+        # `PygGraphPropPredDataset` loads the processed file itself, fully into memory. It can't be memory mapped
+        # without bypassing that constructor, so don't load it a second time here.
         super().__init__("ogbg-molpcba", root, transform, pre_transform)
-        self.data, self.slices = torch.load(self.processed_paths[0])
 
     @property
     def processed_file_names(self):
@@ -85,4 +86,4 @@ class OGBDataset(PygGraphPropPredDataset):
         data, slices = self.collate(processed_data_list)
 
         print("Saving...")
-        torch.save((data, slices), self.processed_paths[0])
+        torch.save((data, slices), self.processed_paths[0], pickle_protocol=5)
@@ -5,17 +5,19 @@ import torch
 
 
 def shortest_path_distance(
-    edge_index: torch.Tensor, max_distance: int = 5
+    edge_index: torch.Tensor, num_nodes: int, max_distance: int = 5
 ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-    edges = [(x.item() + 1, y.item() + 1) for x, y in zip(edge_index[0], edge_index[1])]
-
-    # Insert VNODE, disconnected to allow physical paths between nodes in SPD
-    edges.insert(0, (0, 0))
-
-    node_paths, edge_paths = gnn_tools.shortest_paths(edges, max_distance)  # type: ignore
-    # (num_nodes, num_nodes, max_path_len)
-    node_paths_tensor = torch.Tensor(node_paths).int()
-    edge_paths_tensor = torch.Tensor(edge_paths).int()
+    # Shift every node up by one and insert VNODE as node 0 with only a self loop, disconnected to allow physical
+    # paths between nodes in SPD
+    vnode_edge_index = torch.cat((edge_index.new_zeros(2, 1), edge_index + 1), dim=1)
+    num_nodes += 1
+
+    node_paths, edge_paths = gnn_tools.shortest_paths(  # type: ignore
+        vnode_edge_index[0].tolist(), vnode_edge_index[1].tolist(), num_nodes, max_distance
+    )
+    # (num_nodes, num_nodes, max_path_len), kept as int16 like the kernel output to halve their size in datasets
+    node_paths_tensor = torch.tensor(node_paths, dtype=torch.int16).view(num_nodes, num_nodes, max_distance)
+    edge_paths_tensor = torch.tensor(edge_paths, dtype=torch.int16).view(num_nodes, num_nodes, max_distance)
 
     # Connect VNODE node paths
     # Set VNODE paths to [0, node, -1...]
@@ -29,9 +31,10 @@ def shortest_path_distance(
 
     # Connect VNODE edge paths
     # Set VNODE edge paths to [new_edge, -1 ... ]
+    max_edge_idx = int(edge_paths_tensor.max().item())
     extra_edge_idxs = torch.arange(
-        torch.max(edge_paths_tensor).item() + 1,
-        torch.max(edge_paths_tensor).item() + node_paths_tensor.shape[1],
+        max_edge_idx + 1,
+        max_edge_idx + node_paths_tensor.shape[1],
     ).unsqueeze(-1)
     # VNODE -> Node
     edge_paths_tensor[0, 1:, :1] = extra_edge_idxs
@@ -5,6 +5,7 @@ from torch_geometric.loader import DataLoader
 from graphormer.config.data import DataConfig
 from graphormer.modules.model import Graphormer
 from graphormer.config.utils import model_init_print
+from graphormer.utils import amp_dtype
 from tqdm import tqdm
 from typing import Dict, List
 
@@ -15,29 +16,27 @@ def inference_model(
     data_config: Optional[DataConfig] = None,
     mc_samples: Optional[int] = None,
 ) -> Dict[int, Dict[str, List[float] | int]]:
-    if data_config is None:
-        data_config = hparam_config.data_config()
+    # Only build the dataset when no loader was given
+    if inference_loader is None:
+        if data_config is None:
+            data_config = hparam_config.data_config()
+        inference_loader = data_config.build()  # type: ignore
+        hparam_config.node_feature_dim = data_config.num_node_features
+        hparam_config.edge_feature_dim = data_config.num_edge_features
     model_config = hparam_config.model_config()
 
     mc_dropout = mc_samples is not None
     mc_dropout_rate = 0.1
 
-    inference_loader = data_config.build()
-
     assert hparam_config.batch_size is not None
-    assert data_config.num_node_features is not None
-    assert data_config.num_edge_features is not None
+    assert hparam_config.node_feature_dim is not None
+    assert hparam_config.edge_feature_dim is not None
 
     device = torch.device(hparam_config.torch_device)
-    model: Graphormer = (
-        model_config.with_node_feature_dim(data_config.num_node_features)
-        .with_edge_feature_dim(data_config.num_edge_features)
-        .with_output_dim(1)
-        .build()
-        .to(device)
-    )
+    model: Graphormer = model_config.with_output_dim(1).build().to(device)
 
     model_init_print(hparam_config, model, test_dataloader=inference_loader)
+    autocast_params = {"device_type": device.type, "dtype": amp_dtype(device), "enabled": bool(hparam_config.amp)}
 
     results = {}
 
@@ -49,12 +48,12 @@ def inference_model(
             for batch_idx, batch in enumerate(inference_loader):
                 sample_idx: int = batch_idx * hparam_config.batch_size
 
-                batch.to(device)
-                y = batch.y.to(device)
-                with torch.no_grad():
+                batch.to(device, non_blocking=True)
+                y = batch.y
+                with torch.inference_mode(), torch.autocast(**autocast_params):
                     output = model(batch)
 
-                batch_eval_preds = torch.sigmoid(output).tolist()
+                batch_eval_preds = torch.sigmoid(output.float()).tolist()
                 batch_eval_labels = y.cpu().numpy()
 
                 for pred, label in zip(batch_eval_preds, batch_eval_labels):
@@ -69,12 +68,12 @@ def inference_model(
 
     for batch_idx, batch in enumerate(inference_loader):
         sample_idx: int = batch_idx * hparam_config.batch_size
-        batch.to(device)
-        y = batch.y.to(device)
-        with torch.no_grad():
+        batch.to(device, non_blocking=True)
+        y = batch.y
+        with torch.inference_mode(), torch.autocast(**autocast_params):
             output = model(batch)
 
-            batch_eval_preds = torch.sigmoid(output).tolist()
+            batch_eval_preds = torch.sigmoid(output.float()).tolist()
             batch_eval_labels = y.cpu().numpy()
 
             for pred, label in zip(batch_eval_preds, batch_eval_labels):
@@ -2,16 +2,13 @@ from typing import List
 import torch
 from matplotlib.figure import Figure
 from torch.nn.utils.rnn import pad_sequence
-from graphormer.config.options import AttentionType
-from graphormer.modules.attention import GraphormerFishAttention
-from graphormer.modules.model import Graphormer
 import matplotlib.pyplot as plt
 
 plt.switch_backend("agg")
 
 
-def plot_edge_path_length_bias(model: Graphormer) -> Figure:
-    length_bias = [x.mean().item() for x in model.module_dict["edge_encoding"].edge_vector]
+def plot_edge_path_length_bias(edge_vector: torch.Tensor) -> Figure:
+    length_bias = edge_vector.mean(dim=-1).tolist()
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(length_bias, marker="o", linestyle="-", color="b")
     ax.set_title("Edge Encoding Path Length Bias")
@@ -22,8 +19,8 @@ def plot_edge_path_length_bias(model: Graphormer) -> Figure:
     return fig
 
 
-def plot_node_path_length_bias(model: Graphormer) -> Figure:
-    length_bias = [x.item() for x in model.module_dict["spatial_encoding"].b]
+def plot_node_path_length_bias(b: torch.Tensor) -> Figure:
+    length_bias = b.tolist()
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(length_bias, marker="o", linestyle="-", color="b")
     ax.set_title("Spatial Encoding Path Length Bias")
@@ -34,8 +31,8 @@ def plot_node_path_length_bias(model: Graphormer) -> Figure:
     return fig
 
 
-def plot_centrality_in_degree_bias(model: Graphormer) -> Figure:
-    z_in_bias = [x.mean().item() for x in model.module_dict["centrality_encoding"].z_in]
+def plot_centrality_in_degree_bias(z_in: torch.Tensor) -> Figure:
+    z_in_bias = z_in.mean(dim=-1).tolist()
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(z_in_bias, marker="o", linestyle="-", color="b")
     ax.set_title("Centrality Encoding In Degree Bias")
@@ -46,8 +43,8 @@ def plot_centrality_in_degree_bias(model: Graphormer) -> Figure:
     return fig
 
 
-def plot_centrality_out_degree_bias(model: Graphormer) -> Figure:
-    z_out_bias = [x.mean().item() for x in model.module_dict["centrality_encoding"].z_out]
+def plot_centrality_out_degree_bias(z_out: torch.Tensor) -> Figure:
+    z_out_bias = z_out.mean(dim=-1).tolist()
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(z_out_bias, marker="o", linestyle="-", color="b")
     ax.set_title("Centrality Encoding Out Degree Bias")
@@ -58,8 +55,8 @@ def plot_centrality_out_degree_bias(model: Graphormer) -> Figure:
     return fig
 
 
-def plot_layer_residual_weights(model: Graphormer) -> Figure:
-    res_gates = [x.alpha.item() for k, x in model.module_dict.items() if k.startswith("residual_layer")]
+def plot_layer_residual_weights(alphas: List[torch.Tensor]) -> Figure:
+    res_gates = torch.cat(alphas).tolist()
     fig, ax = plt.subplots(figsize=(10, 5))
     ax.plot(res_gates, marker="o", linestyle="-", color="b")
     ax.set_title("Layer Residual Weights")
@@ -70,11 +67,10 @@ def plot_layer_residual_weights(model: Graphormer) -> Figure:
     return fig
 
 
-def plot_attention_sigma(model: Graphormer) -> Figure:
-    attention_layers: List[GraphormerFishAttention] = [x.attention for k, x in model.module_dict.items() if k.startswith("residual_layer") and isinstance(x.attention, GraphormerFishAttention)]  # type: ignore
-    sigma: torch.Tensor = pad_sequence([layer.sigma for layer in attention_layers], padding_value=0.0)
+def plot_attention_sigma(sigmas: List[torch.Tensor]) -> Figure:
+    sigma: torch.Tensor = pad_sequence(sigmas, padding_value=0.0)
     fig, ax = plt.subplots()
-    cax = ax.imshow(sigma.detach().cpu().numpy(), cmap="viridis")
+    cax = ax.imshow(sigma.numpy(), cmap="viridis")
     fig.colorbar(cax)
     ax.set_title("Sigma Strength by Layer and Attention Head")
     ax.set_xlabel("Layer")
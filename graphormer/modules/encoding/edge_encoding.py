@@ -29,8 +29,9 @@ class EdgeEncoding(nn.Module):
         """
         batch_size = data.edge_paths.shape[0]
         edge_mask = data.edge_paths == -1
-        edge_paths_clamped = data.edge_paths.clamp(min=0)
-        batch_indices = torch.arange(batch_size).view(batch_size, 1, 1, 1).expand_as(data.edge_paths)
+        edge_paths_clamped = data.edge_paths.clamp(min=0).long()
+        batch_indices = torch.arange(batch_size, device=data.edge_paths.device)
+        batch_indices = batch_indices.view(batch_size, 1, 1, 1).expand_as(data.edge_paths)
 
         # Get the edge embeddings for each edge in the paths (when defined)
         assert data.edge_embedding is not None
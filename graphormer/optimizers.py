@@ -0,0 +1,66 @@
+from typing import Callable, Iterable, Optional, Tuple
+
+import torch
+from torch.optim import Optimizer
+
+
+class Lamb(Optimizer):
+    """
+        Implements the LAMB optimizer described in "Large Batch Optimization for Deep Learning: Training BERT
+    in 76 minutes" by You et al. 2019.
+    https://arxiv.org/abs/1904.00962
+    """
+
+    def __init__(
+        self,
+        params: Iterable[torch.Tensor],
+        lr: float = 1e-3,
+        betas: Tuple[float, float] = (0.9, 0.999),
+        eps: float = 1e-6,
+        weight_decay: float = 0.0,
+    ):
+        assert 0 <= betas[0] < 1, f"betas[0] must be in the range [0, 1), got: {betas[0]}"
+        assert 0 <= betas[1] < 1, f"betas[1] must be in the range [0, 1), got: {betas[1]}"
+        defaults = {"lr": lr, "betas": betas, "eps": eps, "weight_decay": weight_decay}
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure: Optional[Callable[[], float]] = None) -> Optional[float]:  # type: ignore
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                grad = param.grad
+
+                state = self.state[param]
+                if len(state) == 0:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                    state["exp_avg_sq"] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+                state["step"] += 1
+
+                exp_avg.lerp_(grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+
+                update = (exp_avg / bias_correction1) / (exp_avg_sq / bias_correction2).sqrt().add_(group["eps"])
+                if group["weight_decay"] != 0:
+                    update.add_(param, alpha=group["weight_decay"])
+
+                # Layer-wise trust ratio ||w|| / ||update||, kept on device to avoid a sync per parameter
+                weight_norm = param.norm()
+                update_norm = update.norm()
+                trust_ratio = torch.where(
+                    (weight_norm > 0) & (update_norm > 0), weight_norm / update_norm, torch.ones_like(weight_norm)
+                )
+                param.sub_(update.mul_(trust_ratio * group["lr"]))
+
+        return loss
@@ -1,4 +1,6 @@
-from typing import List, Optional, Self
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Self, Tuple
 
 import optuna
 import torch
@@ -12,8 +14,8 @@ from tqdm import tqdm
 
 from graphormer.config.hparams import HyperparameterConfig
 from graphormer.config.options import AttentionType, LossReductionType, ResidualType, SchedulerType
-from graphormer.config.utils import calculate_pos_weight, model_init_print, save_checkpoint
-from graphormer.data.dataloader import GraphormerBatch, GraphormerDataLoader
+from graphormer.config.utils import calculate_pos_weight, model_init_print, snapshot_checkpoint, write_checkpoint
+from graphormer.data.dataloader import DevicePrefetcher, GraphormerBatch, GraphormerDataLoader
 from graphormer.model_analysis import (
     plot_attention_sigma,
     plot_centrality_in_degree_bias,
@@ -22,8 +24,14 @@ from graphormer.model_analysis import (
     plot_layer_residual_weights,
     plot_node_path_length_bias,
 )
+from graphormer.modules.attention import GraphormerFishAttention
 from graphormer.modules.model import Graphormer
 from graphormer.schedulers import GreedyLR
+from graphormer.utils import amp_dtype
+
+# Reading a loss back from the device synchronises with it, so per batch losses are buffered on the device and read
+# back together every this many batches
+BATCH_LOG_INTERVAL = 20
 
 
 class Trainer:
@@ -50,6 +58,31 @@ class Trainer:
         self.loss = loss
         self.writer = writer
         self.effective_batch_size = effective_batch_size
+        # Summed losses are averaged per sample when logged, decided once rather than on every logged batch
+        self.per_sample_losses = hparam_config.loss_reduction == LossReductionType.SUM
+        self.loss_divisor = float(hparam_config.batch_size) if self.per_sample_losses else 1.0  # type: ignore
+        # Detached losses waiting to be written by `flush_batch_losses`, with their batch number (and batch size)
+        self.train_batch_losses: List[Tuple[int, torch.Tensor, int]] = []
+        self.eval_batch_losses: List[Tuple[int, torch.Tensor]] = []
+        # Epoch figures are drawn on a background thread while the next epoch trains
+        self.figure_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_figures: Optional[Future] = None
+        # Checkpoints are snapshotted to the CPU, then written on a background thread so `torch.save` stays off
+        # the training loop
+        self.checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_checkpoint: Optional[Future] = None
+        # Used for forward passes, checkpoints keep saving `model` so that state dict keys stay unprefixed.
+        # Compiling here rather than in `fit` means a trainer compiles once however many times it is fit.
+        self.compiled_model = model
+        if hparam_config.torch_compile:
+            # Batches vary in node count, so compile for dynamic shapes up front rather than recompiling per size.
+            # "reduce-overhead" is avoided on purpose: its CUDA graphs record a separate graph and memory pool for
+            # every padded batch shape, which grows without bound here.
+            self.compiled_model = torch.compile(model, dynamic=True)  # type: ignore
+        self.amp_dtype = amp_dtype(device)
+        self.scaler = torch.amp.GradScaler(  # type: ignore
+            device.type, enabled=hparam_config.amp and self.amp_dtype == torch.float16
+        )
 
     @classmethod
     def build(
@@ -59,10 +92,16 @@ class Trainer:
         test_loader: Optional[GraphormerDataLoader] = None,
     ) -> Self:
         device = torch.device(hparam_config.torch_device)
+        if device.type == "cuda":
+            # Let fp32 matmuls run on TF32 tensor cores, this also covers the matmuls autocast leaves in fp32
+            torch.set_float32_matmul_precision("high")
+            torch.backends.cudnn.allow_tf32 = True
         logging_config = hparam_config.logging_config()
-        data_config = hparam_config.data_config()
         if train_loader is None or test_loader is None:
+            data_config = hparam_config.data_config()
             train_loader, test_loader = data_config.build()
+            hparam_config.node_feature_dim = data_config.num_node_features
+            hparam_config.edge_feature_dim = data_config.num_edge_features
 
         assert train_loader is not None
         assert test_loader is not None
@@ -74,15 +113,10 @@ class Trainer:
         assert hparam_config.last_effective_batch_num is not None
 
         writer = logging_config.build()
-        assert data_config.num_node_features is not None
-        assert data_config.num_edge_features is not None
-        model = (
-            model_config.with_node_feature_dim(data_config.num_node_features)
-            .with_edge_feature_dim(data_config.num_edge_features)
-            .with_output_dim(1)
-            .build()
-            .to(hparam_config.torch_device)
-        )
+        # Feature dims come from whichever build produced the loaders
+        assert hparam_config.node_feature_dim is not None
+        assert hparam_config.edge_feature_dim is not None
+        model = model_config.with_output_dim(1).build().to(hparam_config.torch_device)
         pos_weight = calculate_pos_weight(train_loader)
         loss = loss_config.with_pos_weight(pos_weight).build()
         optimizer = optimizer_config.build(model)
@@ -107,16 +141,12 @@ class Trainer:
         trial: Optional[Trial] = None,
         train_loader: Optional[GraphormerDataLoader] = None,
         test_loader: Optional[GraphormerDataLoader] = None,
-        optimized_model: bool = False,
     ) -> float:
         train_loader = train_loader if train_loader is not None else self.train_loader
         test_loader = test_loader if test_loader is not None else self.test_loader
         model_init_print(self.hparam_config, self.model, train_loader, test_loader)
         self.model.train()
 
-        if optimized_model:
-            self.model: Graphormer = torch.compile(self.model, mode="max_autotune")  # type: ignore
-
         progress_bar = tqdm(total=0, desc="Initializing...", unit="batch")
         train_batches_per_epoch = len(train_loader)
         eval_batches_per_epoch = len(test_loader)
@@ -127,50 +157,59 @@ class Trainer:
         assert self.hparam_config.last_effective_batch_num is not None
         assert self.hparam_config.batch_size is not None
 
+        # Tuning trials only train on the first `tune_size` of every epoch, so stop drawing from the loader there
+        # instead of letting its workers load batches that would be skipped
+        max_train_batches = train_batches_per_epoch
+        if self.hparam_config.tune_size is not None and trial is not None:
+            max_train_batches = min(
+                int(self.hparam_config.tune_size * train_batches_per_epoch) + 1, train_batches_per_epoch
+            )
+
         for epoch in range(self.hparam_config.start_epoch, self.hparam_config.epochs):
-            total_train_loss = 0.0
-            total_eval_loss = 0.0
+            # Kept on the device so that accumulating them does not synchronise every batch
+            total_train_loss = torch.zeros((), device=self.device)
+            total_eval_loss = torch.zeros((), device=self.device)
 
             # Set total length for training phase and update description
-            progress_bar.reset(total=len(train_loader))
+            progress_bar.reset(total=max_train_batches)
             progress_bar.set_description(f"Epoch {epoch+1}/{self.hparam_config.epochs} Train")
 
             self.model.train()
 
             avg_loss = 0.0
             train_batch_num = epoch * train_batches_per_epoch
-            loss_values = []
-            for batch_idx, batch in enumerate(train_loader):
-                if (
-                    self.hparam_config.tune_size is not None
-                    and batch_idx / train_batches_per_epoch > self.hparam_config.tune_size
-                    and trial is not None
-                ):
-                    break
-
+            num_train_batches = 0
+            train_batches = itertools.islice(train_loader, max_train_batches)
+            for batch_idx, batch in enumerate(DevicePrefetcher(train_batches, self.device)):
                 if train_batch_num == 0 and trial is None:
-                    self.optimizer.zero_grad()
+                    self.optimizer.zero_grad(set_to_none=True)
 
-                batch_loss = self.train_step(batch, batch_idx, train_batch_num, loss_values, train_batches_per_epoch)
+                batch_loss = self.train_step(batch, batch_idx, train_batch_num, train_batches_per_epoch)
 
                 total_train_loss += batch_loss
-                progress_bar.set_postfix_str(f"Avg Loss: {avg_loss:.4f}")
-                progress_bar.update()  # Increment the progress bar
+                num_train_batches += 1
                 train_batch_num += 1
+                # Reading the average loss synchronises with the device, so the progress bar advances in bursts
+                if num_train_batches % BATCH_LOG_INTERVAL == 0:
+                    avg_loss = self.average_loss(total_train_loss, num_train_batches)
+                    progress_bar.set_postfix_str(f"Avg Loss: {avg_loss:.4f}", refresh=False)
+                    progress_bar.update(BATCH_LOG_INTERVAL)
+            progress_bar.update(num_train_batches - progress_bar.n)
 
-                avg_loss = total_train_loss / (batch_idx + 1)
-                if self.hparam_config.loss_reduction == LossReductionType.SUM:
-                    avg_loss /= self.hparam_config.batch_size
-                self.writer.add_scalar("train/avg_train_loss", avg_loss, epoch)
+            self.flush_batch_losses()
+            avg_loss = self.average_loss(total_train_loss, num_train_batches)
+            self.writer.add_scalar("train/avg_train_loss", avg_loss, epoch)
 
             if isinstance(self.scheduler, PolynomialLR):
                 self.scheduler.step()
+            # Logged once per epoch, keep this out of the batch loop even though OneCycleLR steps per batch
+            last_lr = self.scheduler.get_last_lr()[0]
             self.writer.add_scalar(
                 "train/lr",
                 (
-                    self.scheduler.get_last_lr()[0] * self.hparam_config.accumulation_steps
+                    last_lr * self.hparam_config.accumulation_steps
                     if self.hparam_config.loss_reduction == LossReductionType.MEAN
-                    else self.scheduler.get_last_lr()[0] * self.effective_batch_size
+                    else last_lr * self.effective_batch_size
                 ),
                 epoch,
             )
@@ -184,64 +223,32 @@ class Trainer:
 
             self.model.eval()
             eval_batch_num = epoch * eval_batches_per_epoch
-            for batch in test_loader:
+            for batch_idx, batch in enumerate(DevicePrefetcher(test_loader, self.device)):
                 batch_loss = self.eval_step(batch, eval_batch_num, all_eval_preds, all_eval_labels)
                 total_eval_loss += batch_loss
-                progress_bar.update()
                 eval_batch_num += 1
+                if (batch_idx + 1) % BATCH_LOG_INTERVAL == 0:
+                    progress_bar.update(BATCH_LOG_INTERVAL)
+            progress_bar.update(len(test_loader) - progress_bar.n)
+            self.flush_batch_losses()
 
+            total_eval_loss = total_eval_loss.item()
             if isinstance(self.scheduler, (ReduceLROnPlateau, GreedyLR)):
                 self.scheduler.step(total_eval_loss)
 
-            avg_eval_loss = total_eval_loss / len(test_loader)
-            if self.hparam_config.loss_reduction == LossReductionType.SUM:
-                avg_eval_loss /= float(self.hparam_config.batch_size)
+            avg_eval_loss = self.average_loss(total_eval_loss, len(test_loader))
             progress_bar.set_postfix_str(f"Avg Eval Loss: {avg_eval_loss:.4f}")
-            bac = balanced_accuracy_score(all_eval_labels, all_eval_preds)
-            ac = accuracy_score(all_eval_labels, all_eval_preds)
-            bac_adj = balanced_accuracy_score(all_eval_labels, all_eval_preds, adjusted=True)
+            # A single copy back to the host for the whole epoch
+            eval_labels = torch.cat(all_eval_labels).cpu().numpy()
+            eval_preds = torch.cat(all_eval_preds).cpu().numpy()
+            bac = balanced_accuracy_score(eval_labels, eval_preds)
+            ac = accuracy_score(eval_labels, eval_preds)
+            bac_adj = balanced_accuracy_score(eval_labels, eval_preds, adjusted=True)
             self.writer.add_scalar("eval/acc", ac, epoch)
             self.writer.add_scalar("eval/bac", bac, epoch)
             self.writer.add_scalar("eval/bac_adj", bac_adj, epoch)
             self.writer.add_scalar("eval/avg_eval_loss", avg_eval_loss, epoch)
-            self.writer.add_figure(
-                # type: ignore
-                "plot/edge_encoding_bias",
-                plot_edge_path_length_bias(self.model),
-                epoch,
-            )
-            self.writer.add_figure(
-                # type: ignore
-                "plot/node_encoding_bias",
-                plot_node_path_length_bias(self.model),
-                epoch,
-            )
-            self.writer.add_figure(
-                "plot/centrality_in_degree_bias",
-                # type: ignore
-                plot_centrality_in_degree_bias(self.model),
-                epoch,
-            )
-            self.writer.add_figure(
-                "plot/centrality_out_degree_bias",
-                # type: ignore
-                plot_centrality_out_degree_bias(self.model),
-                epoch,
-            )
-            if self.hparam_config.residual_type == ResidualType.REZERO:
-                self.writer.add_figure(
-                    # type: ignore
-                    "plot/residual_weigths",
-                    plot_layer_residual_weights(self.model),
-                    epoch,
-                )
-            if self.hparam_config.attention_type == AttentionType.FISH:
-                self.writer.add_figure(
-                    # type: ignore
-                    "plot/sigma_strength",
-                    plot_attention_sigma(self.model),
-                    epoch,
-                )
+            self.write_figures(epoch)
 
             print(
                 f"Epoch {epoch+1} | Avg Train Loss: {avg_loss:.4f} | Avg Eval Loss: {
@@ -250,31 +257,20 @@ class Trainer:
 
             if total_eval_loss < self.hparam_config.best_loss and trial is None:
                 self.hparam_config.best_loss = total_eval_loss
-                save_checkpoint(
-                    epoch,
-                    self.hparam_config,
-                    self.model,
-                    self.optimizer,
-                    self.loss,
-                    self.scheduler,
-                    "best",
-                )
+                self.save_checkpoint(epoch, "best")
 
             if epoch % self.hparam_config.checkpt_save_interval == 0 and trial is None:
-                save_checkpoint(
-                    epoch,
-                    self.hparam_config,
-                    self.model,
-                    self.optimizer,
-                    self.loss,
-                    self.scheduler,
-                )
+                self.save_checkpoint(epoch)
 
             if trial is not None:
                 trial.report(avg_eval_loss, epoch)
                 if trial.should_prune():
                     raise optuna.exceptions.TrialPruned()
 
+        if self.pending_figures is not None:
+            self.pending_figures.result()
+        if self.pending_checkpoint is not None:
+            self.pending_checkpoint.result()
         progress_bar.close()
         return avg_eval_loss
 
@@ -283,62 +279,155 @@ class Trainer:
         batch: GraphormerBatch,
         batch_idx: int,
         train_batch_num: int,
-        loss_values: List[float],
         train_batches_per_epoch: int,
-    ):
-        batch.to(self.device)  # type: ignore
-        y = batch.y.to(self.device)  # type: ignore
-
-        output = self.model(batch)
+    ) -> torch.Tensor:
+        y = batch.y  # type: ignore
 
-        loss = self.loss(output, y)
+        with torch.autocast(self.device.type, dtype=self.amp_dtype, enabled=self.hparam_config.amp):
+            output = self.compiled_model(batch)
+            loss = self.loss(output, y)
 
-        loss.backward()
+        self.scaler.scale(loss).backward()
 
-        torch.nn.utils.clip_grad_norm_(
-            self.model.parameters(), self.hparam_config.clip_grad_norm, error_if_nonfinite=True
-        )
         if should_step(batch_idx, self.hparam_config.accumulation_steps, train_batches_per_epoch):  # type: ignore
-            self.optimizer.step()
-            self.optimizer.zero_grad()
+            # Gradients can only be unscaled once per step, so clip the accumulated gradients right before stepping
+            self.scaler.unscale_(self.optimizer)
+            # Scaled fp16 gradients may overflow, in which case the scaler skips the step instead of raising
+            torch.nn.utils.clip_grad_norm_(
+                self.model.parameters(),
+                self.hparam_config.clip_grad_norm,
+                error_if_nonfinite=not self.scaler.is_enabled(),
+            )
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+            self.optimizer.zero_grad(set_to_none=True)
             if isinstance(self.scheduler, OneCycleLR):
                 self.scheduler.step()
                 self.hparam_config.last_effective_batch_num += 1  # type: ignore
 
-        batch_loss = loss.item()
-        loss_values.append(batch_loss)
-        self.writer.add_scalar("train/batch_loss", batch_loss, train_batch_num)
-        self.writer.add_scalar(
-            "train/sample_loss",
-            (
-                batch_loss / output.shape[0]
-                if self.hparam_config.loss_reduction == LossReductionType.SUM
-                else batch_loss
-            ),
-            train_batch_num,
-        )
+        batch_loss = loss.detach()
+        self.train_batch_losses.append((train_batch_num, batch_loss, output.shape[0]))
+        if len(self.train_batch_losses) >= BATCH_LOG_INTERVAL:
+            self.flush_batch_losses()
         return batch_loss
 
     def eval_step(
-        self, batch: GraphormerBatch, eval_batch_num: int, all_eval_preds: List[float], all_eval_labels: List[int]
-    ):
-        batch.to(self.device)  # type: ignore
-        y = batch.y.to(self.device)  # type: ignore
-        with torch.no_grad():
-            output = self.model(batch)
+        self,
+        batch: GraphormerBatch,
+        eval_batch_num: int,
+        all_eval_preds: List[torch.Tensor],
+        all_eval_labels: List[torch.Tensor],
+    ) -> torch.Tensor:
+        y = batch.y  # type: ignore
+        with (
+            torch.inference_mode(),
+            torch.autocast(self.device.type, dtype=self.amp_dtype, enabled=self.hparam_config.amp),
+        ):
+            output = self.compiled_model(batch)
             loss = self.loss(output, y)
-        batch_loss: float = loss.item()
-        self.writer.add_scalar("eval/batch_loss", batch_loss, eval_batch_num)
+        batch_loss = loss.detach()
+        self.eval_batch_losses.append((eval_batch_num, batch_loss))
+        if len(self.eval_batch_losses) >= BATCH_LOG_INTERVAL:
+            self.flush_batch_losses()
+
+        # sigmoid(x) > 0.5 exactly when x > 0, so threshold the logits on device
+        all_eval_preds.append((output > 0).to(torch.int8))
+        all_eval_labels.append(y)
+        return batch_loss
 
-        eval_preds = torch.round(torch.sigmoid(output)).tolist()
-        eval_labels = y.cpu().numpy()
-        if sum(eval_labels) > 0:
-            batch_bac = balanced_accuracy_score(eval_labels, eval_preds)
-            self.writer.add_scalar("eval/batch_bac", batch_bac, eval_batch_num)
+    def save_checkpoint(self, epoch: int, suffix: Optional[str] = None) -> None:
+        # Wait for the previous write, so at most one snapshot is held in host memory
+        if self.pending_checkpoint is not None:
+            self.pending_checkpoint.result()
+        checkpoint = snapshot_checkpoint(
+            epoch, self.hparam_config, self.model, self.optimizer, self.loss, self.scheduler
+        )
+        self.pending_checkpoint = self.checkpoint_executor.submit(
+            write_checkpoint, checkpoint, self.hparam_config, suffix
+        )
 
-        all_eval_preds.extend(eval_preds)
-        all_eval_labels.extend(eval_labels)
-        return batch_loss
+    def write_figures(self, epoch: int) -> None:
+        # Wait for the previous epoch's figures, so figures are written in order
+        if self.pending_figures is not None:
+            self.pending_figures.result()
+        # Copy only the plotted parameters to the host, as training carries on updating the live ones
+        modules = self.model.module_dict
+        residual_layers = [module for name, module in modules.items() if name.startswith("residual_layer")]
+        snapshot = {
+            "edge_vector": modules["edge_encoding"].edge_vector.detach().cpu(),
+            "b": modules["spatial_encoding"].b.detach().cpu(),
+            "z_in": modules["centrality_encoding"].z_in.detach().cpu(),
+            "z_out": modules["centrality_encoding"].z_out.detach().cpu(),
+        }
+        if self.hparam_config.residual_type == ResidualType.REZERO:
+            snapshot["alphas"] = [layer.alpha.detach().cpu() for layer in residual_layers]
+        if self.hparam_config.attention_type == AttentionType.FISH:
+            snapshot["sigmas"] = [
+                layer.attention.sigma.detach().cpu()
+                for layer in residual_layers
+                if isinstance(layer.attention, GraphormerFishAttention)
+            ]
+        self.pending_figures = self.figure_executor.submit(self._write_figures, snapshot, epoch)
+
+    def _write_figures(self, snapshot: Dict[str, Any], epoch: int) -> None:
+        self.writer.add_figure(
+            # type: ignore
+            "plot/edge_encoding_bias",
+            plot_edge_path_length_bias(snapshot["edge_vector"]),
+            epoch,
+        )
+        self.writer.add_figure(
+            # type: ignore
+            "plot/node_encoding_bias",
+            plot_node_path_length_bias(snapshot["b"]),
+            epoch,
+        )
+        self.writer.add_figure(
+            "plot/centrality_in_degree_bias",
+            # type: ignore
+            plot_centrality_in_degree_bias(snapshot["z_in"]),
+            epoch,
+        )
+        self.writer.add_figure(
+            "plot/centrality_out_degree_bias",
+            # type: ignore
+            plot_centrality_out_degree_bias(snapshot["z_out"]),
+            epoch,
+        )
+        if "alphas" in snapshot:
+            self.writer.add_figure(
+                # type: ignore
+                "plot/residual_weigths",
+                plot_layer_residual_weights(snapshot["alphas"]),
+                epoch,
+            )
+        # FISH layers with as many global as local heads are plain multi-head attention, without a sigma
+        if snapshot.get("sigmas"):
+            self.writer.add_figure(
+                # type: ignore
+                "plot/sigma_strength",
+                plot_attention_sigma(snapshot["sigmas"]),
+                epoch,
+            )
+
+    def flush_batch_losses(self) -> None:
+        if self.train_batch_losses:
+            batch_nums, losses, batch_sizes = zip(*self.train_batch_losses)
+            # One stacked copy back to the host for the whole buffer
+            for batch_num, batch_loss, batch_size in zip(batch_nums, torch.stack(losses).tolist(), batch_sizes):
+                self.writer.add_scalar("train/batch_loss", batch_loss, batch_num)
+                self.writer.add_scalar(
+                    "train/sample_loss", batch_loss / batch_size if self.per_sample_losses else batch_loss, batch_num
+                )
+            self.train_batch_losses.clear()
+        if self.eval_batch_losses:
+            batch_nums, losses = zip(*self.eval_batch_losses)
+            for batch_num, batch_loss in zip(batch_nums, torch.stack(losses).tolist()):
+                self.writer.add_scalar("eval/batch_loss", batch_loss, batch_num)
+            self.eval_batch_losses.clear()
+
+    def average_loss(self, total_loss: torch.Tensor | float, num_batches: int) -> float:
+        return float(total_loss) / (max(num_batches, 1) * self.loss_divisor)
 
 
 def should_step(batch_idx: int, accumulation_steps: int, train_batches_per_epoch: int) -> bool:
@@ -15,6 +15,12 @@ def difference_idxs(a, b, epsilon=1e-6) -> torch.Tensor:
     return indices
 
 
+def amp_dtype(device: torch.device) -> torch.dtype:
+    # Prefer bf16, which shares fp32's exponent range and is what CPU autocast (AVX-512 BF16 / AMX) runs on.
+    # fp16 can underflow gradients, so it needs a loss scaler, and is only used on GPUs without bf16 support
+    return torch.bfloat16 if device.type != "cuda" or torch.cuda.is_bf16_supported() else torch.float16
+
+
 def parse_models(ctx, param, value):
     return value.split(",")
 
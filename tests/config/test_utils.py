@@ -0,0 +1,37 @@
+import torch
+from torch.utils.data import Subset
+from torch_geometric.data import Data, InMemoryDataset
+from torch_geometric.loader import DataLoader
+
+from graphormer.config.utils import calculate_pos_weight
+
+
+class LabelledDataset(InMemoryDataset):
+    def __init__(self, labels):
+        super().__init__()
+        self.data, self.slices = self.collate([Data(x=torch.zeros(2, 1), y=torch.tensor([label])) for label in labels])
+
+
+class TestCalculatePosWeightGroup:
+    def test_index_selected_dataset(self):
+        dataset = LabelledDataset([1.0, 0.0, 0.0, 1.0, 0.0, 0.0])[torch.tensor([0, 1, 2, 4])]
+
+        pos_weight = calculate_pos_weight(DataLoader(dataset))  # type: ignore
+
+        assert torch.equal(pos_weight, torch.tensor([3.0]))
+        # The labels were read from storage, rather than by rebuilding the selected graphs
+        assert dataset._data_list is None or all(data is None for data in dataset._data_list)
+
+    def test_subset_of_index_selected_dataset(self):
+        dataset = LabelledDataset([1.0, 0.0, 1.0, 1.0, 0.0, 0.0])[torch.tensor([5, 4, 3, 2])]
+        subset = Subset(dataset, [0, 2, 3])  # type: ignore
+
+        pos_weight = calculate_pos_weight(DataLoader(subset))  # type: ignore
+
+        assert torch.equal(pos_weight, torch.tensor([0.5]))
+        assert dataset._data_list is None or all(data is None for data in dataset._data_list)
+
+    def test_whole_dataset(self):
+        dataset = LabelledDataset([1.0, 0.0, 0.0, 0.0])
+
+        assert torch.equal(calculate_pos_weight(DataLoader(dataset)), torch.tensor([3.0]))  # type: ignore
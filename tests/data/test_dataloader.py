@@ -0,0 +1,76 @@
+import torch
+import torch.nn.functional as F
+import torch.nn.utils.rnn as rnn
+from torch_geometric.utils import from_smiles
+
+from graphormer.data.data_cleaning import process
+from graphormer.data.dataloader import GraphormerCollater
+
+
+def reference_collate(graphs):
+    """The per-graph padding loop the collater used before it was vectorized."""
+    max_nodes = max(graph.x.shape[0] for graph in graphs)
+    path_length = graphs[0].node_paths.shape[-1]
+    node_paths = []
+    edge_paths = []
+    for graph in graphs:
+        num_nodes = graph.x.shape[0]
+        # (left, right, top, bottom) over the last two dims of (path_length, num_nodes, num_nodes)
+        pad = (0, max_nodes - num_nodes, 0, max_nodes - num_nodes)
+        for paths, padded in ((graph.node_paths, node_paths), (graph.edge_paths, edge_paths)):
+            paths = paths.reshape(num_nodes, num_nodes, path_length).permute(2, 0, 1)
+            padded.append(F.pad(paths, pad, mode="constant", value=-1).permute(1, 2, 0))
+
+    return {
+        "x": rnn.pad_sequence([graph.x.float() for graph in graphs], batch_first=True, padding_value=-2),
+        "degrees": rnn.pad_sequence([graph.degrees for graph in graphs], batch_first=True, padding_value=-1)
+        .transpose(1, 2)
+        .long(),
+        "edge_attr": rnn.pad_sequence(
+            [graph.edge_attr.float() for graph in graphs], batch_first=True, padding_value=-1
+        ),
+        "node_paths": torch.stack(node_paths).long(),
+        "edge_paths": torch.stack(edge_paths).long(),
+    }
+
+
+class TestGraphormerCollaterGroup:
+    def test_collate_pads_graphs_of_different_sizes(self):
+        max_distance = 5
+        # Ethanol, phenol, and ammonia which has no bonds at all
+        graphs = [process(from_smiles(smiles), max_distance) for smiles in ["CCO", "Oc1ccccc1", "N"]]
+        expected = reference_collate(graphs)
+
+        batch = GraphormerCollater(graphs)(graphs)
+
+        num_nodes = [graph.x.shape[0] for graph in graphs]
+        num_edges = [graph.edge_attr.shape[0] for graph in graphs]
+        max_nodes = max(num_nodes)
+        assert num_nodes == [4, 8, 2]
+
+        assert batch.x.shape == (3, max_nodes, graphs[0].x.shape[1])
+        assert batch.x.dtype == torch.float
+        assert batch.degrees.shape == (3, 2, max_nodes)
+        assert batch.degrees.dtype == torch.long
+        assert batch.edge_attr.shape == (3, max(num_edges), graphs[0].edge_attr.shape[1])
+        assert batch.edge_attr.dtype == torch.float
+        assert batch.node_paths.shape == (3, max_nodes, max_nodes, max_distance)
+        assert batch.node_paths.dtype == torch.int16
+        assert batch.edge_paths.shape == (3, max_nodes, max_nodes, max_distance)
+        assert batch.edge_paths.dtype == torch.int16
+
+        for i, graph in enumerate(graphs):
+            n, e = num_nodes[i], num_edges[i]
+            assert (batch.x[i, :n] == graph.x.float()).all()
+            assert (batch.x[i, n:] == -2).all()
+            assert (batch.degrees[i, :, :n] == graph.degrees.transpose(0, 1)).all()
+            assert (batch.degrees[i, :, n:] == -1).all()
+            assert (batch.edge_attr[i, :e] == graph.edge_attr.float()).all()
+            assert (batch.edge_attr[i, e:] == -1).all()
+            for paths, graph_paths in ((batch.node_paths, graph.node_paths), (batch.edge_paths, graph.edge_paths)):
+                assert (paths[i, :n, :n] == graph_paths.reshape(n, n, max_distance)).all()
+                assert (paths[i, n:] == -1).all()
+                assert (paths[i, :, n:] == -1).all()
+
+        for key, value in expected.items():
+            assert torch.equal(batch[key].long() if key.endswith("paths") else batch[key], value), key
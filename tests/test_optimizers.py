@@ -0,0 +1,73 @@
+import math
+
+import pytest
+import torch
+from torch import nn
+from torch.optim import AdamW
+
+from graphormer.config.optimizer import LAMB_BATCH_SIZE_THRESHOLD, OptimizerConfig
+from graphormer.config.options import LossReductionType, OptimizerType
+from graphormer.optimizers import Lamb
+
+
+class TestLambGroup:
+    def test_step_matches_hand_computed_update(self):
+        lr, beta1, beta2, eps, weight_decay = 0.1, 0.9, 0.999, 1e-6, 0.01
+        weights, grads = [3.0, 4.0], [1.0, -2.0]
+        param = nn.Parameter(torch.tensor(weights, dtype=torch.float64))
+        param.grad = torch.tensor(grads, dtype=torch.float64)
+        optimizer = Lamb([param], lr=lr, betas=(beta1, beta2), eps=eps, weight_decay=weight_decay)
+
+        optimizer.step()
+
+        update = []
+        for w, g in zip(weights, grads):
+            m_hat = (1 - beta1) * g / (1 - beta1)
+            v_hat = (1 - beta2) * g**2 / (1 - beta2)
+            update.append(m_hat / (math.sqrt(v_hat) + eps) + weight_decay * w)
+        trust_ratio = math.hypot(*weights) / math.hypot(*update)
+        expected = [w - lr * trust_ratio * u for w, u in zip(weights, update)]
+        assert torch.allclose(param.detach(), torch.tensor(expected, dtype=torch.float64))
+
+    def test_zero_weight_norm_falls_back_to_unit_trust_ratio(self):
+        lr, eps = 0.1, 1e-6
+        param = nn.Parameter(torch.zeros(2, dtype=torch.float64))
+        param.grad = torch.tensor([1.0, -2.0], dtype=torch.float64)
+        optimizer = Lamb([param], lr=lr, eps=eps)
+
+        optimizer.step()
+
+        expected = [-lr * 1.0 / (1.0 + eps), lr * 2.0 / (2.0 + eps)]
+        assert torch.allclose(param.detach(), torch.tensor(expected, dtype=torch.float64))
+
+    def test_zero_update_norm_leaves_weights_unchanged(self):
+        param = nn.Parameter(torch.tensor([3.0, 4.0]))
+        param.grad = torch.zeros(2)
+        optimizer = Lamb([param], lr=0.1)
+
+        optimizer.step()
+
+        assert torch.equal(param.detach(), torch.tensor([3.0, 4.0]))
+
+
+class TestOptimizerConfigGroup:
+    @staticmethod
+    def build(batch_size: int):
+        config = (
+            OptimizerConfig(OptimizerType.AUTO, LossReductionType.MEAN, 1, batch_size, 1e-3)
+            .with_betas((0.9, 0.999))
+            .with_eps(1e-6)
+            .with_weight_decay(0.0)
+        )
+        return config.build(nn.Linear(2, 1))
+
+    @pytest.mark.parametrize(
+        "batch_size,optimizer_class",
+        [
+            (LAMB_BATCH_SIZE_THRESHOLD + 1, Lamb),
+            (LAMB_BATCH_SIZE_THRESHOLD, AdamW),
+            (LAMB_BATCH_SIZE_THRESHOLD - 1, AdamW),
+        ],
+    )
+    def test_auto_picks_optimizer_by_effective_batch_size(self, batch_size: int, optimizer_class: type):
+        assert type(self.build(batch_size)) is optimizer_class